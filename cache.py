@@ -0,0 +1,146 @@
+"""
+Cache Helper Functions
+
+Redis-backed response cache for read endpoints.
+Decorate GET handlers with `cached(...)` and call `cache.invalidate(...)` after writes.
+Rendered JSON bodies are cached, so a hit is served without re-encoding.
+
+Entries are versioned: each cache key embeds the current generation of its
+base key (e.g. "invoice:list"), and invalidating replaces that generation.
+Entries written by a read that raced a write land under the old generation
+and are never served, rather than lingering until their TTL.
+"""
+
+import functools
+import hashlib
+import json
+import logging
+import os
+import uuid
+from string import Formatter
+from typing import Optional
+
+from dotenv import load_dotenv
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse, Response
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+
+# Load environment variables from .env file
+load_dotenv()
+
+redis_url = os.getenv("REDIS_URL")
+
+SOCKET_TIMEOUT_SECONDS = 0.25
+# Must outlive any cached(expire=...) so an expired generation can't revive old entries
+GENERATION_TTL_SECONDS = 24 * 3600
+
+logger = logging.getLogger(__name__)
+
+
+class RedisCache:
+    """Thin async wrapper around a shared Redis connection pool"""
+
+    def __init__(self, url: Optional[str], max_connections: int = 20):
+        self.url = url
+        self.max_connections = max_connections
+        self._pool = None
+        self._redis = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._redis is not None
+
+    def connect(self):
+        if self.url and self._redis is None:
+            # Short timeouts so a slow or blackholed Redis degrades to a cache miss
+            # instead of stalling every request until the OS TCP timeout
+            self._pool = redis.ConnectionPool.from_url(
+                self.url,
+                max_connections=self.max_connections,
+                socket_connect_timeout=SOCKET_TIMEOUT_SECONDS,
+                socket_timeout=SOCKET_TIMEOUT_SECONDS,
+            )
+            self._redis = redis.Redis(connection_pool=self._pool)
+
+    async def disconnect(self):
+        if self._redis is not None:
+            await self._redis.aclose()
+            await self._pool.disconnect()
+        self._redis = None
+        self._pool = None
+
+    async def get(self, key: str) -> Optional[bytes]:
+        if not self.enabled:
+            return None
+        try:
+            return await self._redis.get(key)
+        except RedisError:
+            return None
+
+    async def set(self, key: str, value: bytes, expire: int):
+        if not self.enabled:
+            return
+        try:
+            await self._redis.set(key, value, ex=expire)
+        except RedisError:
+            pass
+
+    async def generation(self, base: str) -> Optional[str]:
+        """Current generation of a base key; "0" until it is first invalidated"""
+        if not self.enabled:
+            return None
+        try:
+            value = await self._redis.get(f"gen:{base}")
+        except RedisError:
+            return None
+        return value.decode() if value is not None else "0"
+
+    async def invalidate(self, *bases: str):
+        """Start a new generation for each base key, orphaning its cached entries"""
+        if not self.enabled or not bases:
+            return
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                for base in bases:
+                    pipe.set(f"gen:{base}", uuid.uuid4().hex, ex=GENERATION_TTL_SECONDS)
+                await pipe.execute()
+        except RedisError:
+            # Entries for these keys may be served stale until their TTL expires
+            logger.warning("Cache invalidation failed for %s", ", ".join(bases), exc_info=True)
+
+
+cache = RedisCache(redis_url)
+
+
+def _build_key(prefix: str, kwargs: dict):
+    """Fill path params into the prefix; return it plus a hash of any remaining (query) params"""
+    used = {name for _, name, _, _ in Formatter().parse(prefix) if name}
+    base = prefix.format(**{name: kwargs[name] for name in used})
+    rest = {k: v for k, v in kwargs.items() if k not in used}
+    digest = hashlib.md5(json.dumps(rest, sort_keys=True, default=str).encode()).hexdigest() if rest else None
+    return base, digest
+
+
+def cached(prefix: str, expire: int = 3600):
+    """Cache the rendered JSON response of an async endpoint under `prefix`"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            base, digest = _build_key(prefix, kwargs)
+            # Read the generation before the handler so a concurrent write orphans our entry
+            gen = await cache.generation(base)
+            if gen is None:
+                return await func(*args, **kwargs)
+            key = f"{base}:{gen}:{digest}" if digest else f"{base}:{gen}"
+            hit = await cache.get(key)
+            if hit is not None:
+                return Response(content=hit, media_type="application/json")
+            response = await func(*args, **kwargs)
+            if not isinstance(response, Response):
+                response = ORJSONResponse(jsonable_encoder(response))
+            if response.status_code == 200:
+                await cache.set(key, response.body, expire)
+            return response
+        return wrapper
+    return decorator
@@ -5,7 +5,7 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
 from datetime import datetime, timezone
 import os
 from dotenv import load_dotenv
@@ -22,11 +22,28 @@ database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
 if database_url and database_name:
-    _client = MongoClient(database_url)
+    # Async handlers overlap many round-trips, so keep a larger warm pool;
+    # retryable writes absorb a single transient network error
+    _client = AsyncIOMotorClient(
+        database_url,
+        maxPoolSize=200,
+        minPoolSize=20,
+        retryWrites=True,
+        w="majority",
+        serverSelectionTimeoutMS=2000,
+        compressors="zstd",
+        # Read dates back as UTC-aware so responses carry an explicit offset
+        tz_aware=True,
+    )
     db = _client[database_name]
 
+def close_client():
+    """Close the shared Motor client and its connection pool"""
+    if _client is not None:
+        _client.close()
+
 # Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
+async def create_document(collection_name: str, data: Union[BaseModel, dict]):
     """Insert a single document with timestamp"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -40,10 +57,10 @@ def create_document(collection_name: str, data: Union[BaseModel, dict]):
     data_dict['created_at'] = datetime.now(timezone.utc)
     data_dict['updated_at'] = datetime.now(timezone.utc)
 
-    result = db[collection_name].insert_one(data_dict)
+    result = await db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
+async def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
     """Get documents from collection"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -52,4 +69,4 @@ def get_documents(collection_name: str, filter_dict: dict = None, limit: int = N
     if limit:
         cursor = cursor.limit(limit)
     
-    return list(cursor)
+    return [doc async for doc in cursor]
@@ -1,18 +1,58 @@
 import os
-from fastapi import FastAPI, HTTPException
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from fastapi import Body, FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional
+from fastapi.responses import ORJSONResponse, Response
+import orjson
+from pydantic import BaseModel, ConfigDict, Field, PlainSerializer, TypeAdapter
+from pymongo import InsertOne, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
+from typing import Any, List, Optional
+from typing_extensions import Annotated, TypedDict
 
 from database import db
-from database import get_documents
+from database import close_client
+from cache import cache, cached
 from schemas import Invoice
 
-app = FastAPI()
+# PPN applied to legacy invoices stored without a tax_rate
+DEFAULT_TAX_RATE_PERCENT = 11.0
+
+# Comma-separated frontend origins; credentials require an explicit list rather than "*"
+CORS_ORIGINS = [
+    origin.strip()
+    for origin in os.getenv("CORS_ORIGINS", "http://localhost:3000,http://localhost:5173").split(",")
+    if origin.strip()
+]
+
+async def ensure_invoice_indexes():
+    """Create the secondary indexes used by invoice list/lookup queries"""
+    if db is None:
+        return
+    try:
+        await db["invoice"].create_index([("customer", 1), ("updated_at", -1)], background=True)
+        await db["invoice"].create_index([("updated_at", -1), ("_id", 1)], background=True)
+        await db["invoice"].create_index("surat_jalan_no", background=True)
+    except PyMongoError:
+        # Keep serving (e.g. /test diagnostics) even if Mongo is unreachable at startup
+        pass
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The Motor client and Redis pool are shared across all requests
+    cache.connect()
+    await ensure_invoice_indexes()
+    yield
+    await cache.disconnect()
+    close_client()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -26,9 +66,22 @@ def read_root():
 def hello():
     return {"message": "Hello from the backend API!"}
 
+# Health checks may poll /test every few seconds; reuse the result for this long
+HEALTH_TTL_SECONDS = 10
+_health_cache = {}
+
 @app.get("/test")
-def test_database():
+async def test_database():
     """Test endpoint to check if database is available and accessible"""
+    bucket = int(time.monotonic() // HEALTH_TTL_SECONDS)
+    response = _health_cache.get(bucket)
+    if response is None:
+        response = await _compute_health()
+        _health_cache.clear()
+        _health_cache[bucket] = response
+    return response
+
+async def _compute_health():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -46,7 +99,7 @@ def test_database():
             response["database_name"] = _db.name if hasattr(_db, 'name') else "✅ Connected"
             response["connection_status"] = "Connected"
             try:
-                collections = _db.list_collection_names()
+                collections = await _db.list_collection_names()
                 response["collections"] = collections[:10]
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
@@ -63,31 +116,46 @@ def test_database():
 # Utility to convert Mongo _id to id
 
 def serialize_doc(doc: dict):
-    if not doc:
+    if not doc or "_id" not in doc:
         return doc
-    if doc.get("_id"):
-        doc["id"] = str(doc.pop("_id"))
+    _id = doc["_id"]
+    # Invoices use invoice_no (already a str) as _id; only ObjectIds need str()
+    doc["id"] = _id if isinstance(_id, str) else str(_id)
+    del doc["_id"]
     return doc
 
+class MongoJSONResponse(ORJSONResponse):
+    """orjson response for raw Mongo documents; ObjectId and friends fall back to str"""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=str, option=orjson.OPT_NON_STR_KEYS)
+
 # Request models
 class InvoiceCreate(BaseModel):
+    model_config = ConfigDict(extra="ignore", frozen=True, str_strip_whitespace=True)
+
     invoice_no: str
     customer: str
     item_name: str
     surat_jalan_no: str
-    quantity: int
-    price: float
-    tax_rate: float  # percentage, e.g., 11 for 11%
+    # Same bounds as the Invoice schema, so inserts need no second validation pass
+    quantity: int = Field(..., ge=0)
+    price: float = Field(..., ge=0)
+    tax_rate: float = Field(..., ge=0)  # percentage, e.g., 11 for 11%
 
 class InvoiceUpdate(BaseModel):
+    model_config = ConfigDict(extra="ignore", frozen=True, str_strip_whitespace=True)
+
     # Allow editing primary key by providing a new invoice_no
     invoice_no: Optional[str] = None
     customer: Optional[str] = None
     item_name: Optional[str] = None
     surat_jalan_no: Optional[str] = None
-    quantity: Optional[int] = None
-    price: Optional[float] = None
-    tax_rate: Optional[float] = None  # percentage
+    # tax/total are recomputed from these in Mongo, so they may be omitted but
+    # not null (defaults aren't validated; an explicit null is rejected)
+    quantity: int = Field(None, ge=0)
+    price: float = Field(None, ge=0)
+    tax_rate: float = Field(None, ge=0)  # percentage
 
 
 def compute_tax_and_total(quantity: int, price: float, tax_rate_percent: float):
@@ -96,105 +164,207 @@ def compute_tax_and_total(quantity: int, price: float, tax_rate_percent: float):
     total = round(subtotal + tax, 2)
     return tax, total
 
+def tax_and_total_pipeline(update_data: dict):
+    """Aggregation-pipeline update that sets update_data then recomputes tax/total server-side"""
+    # $literal keeps user strings such as "$price" from being read as field paths
+    literal_data = {k: {"$literal": v} for k, v in update_data.items()}
+    tax_rate = {"$divide": [{"$ifNull": ["$tax_rate", DEFAULT_TAX_RATE_PERCENT]}, 100]}
+    return [
+        {"$set": literal_data},
+        {"$set": {"subtotal": {"$multiply": ["$quantity", "$price"]}}},
+        {"$set": {"tax": {"$round": [{"$multiply": ["$subtotal", tax_rate]}, 2]}}},
+        {"$set": {"total": {"$round": [{"$add": ["$subtotal", "$tax"]}, 2]}}},
+        # subtotal is only an intermediate; invoices store tax and total
+        {"$unset": "subtotal"},
+    ]
+
+async def invalidate_invoice_cache(*invoice_nos: str):
+    # Any write invalidates every cached list page plus the touched invoices
+    await cache.invalidate("invoice:list", *(f"invoice:{no}" for no in invoice_nos))
+
+def build_invoice_doc(payload: InvoiceCreate):
+    """Insert-ready invoice document; payload is already validated so no Invoice model is built"""
+    tax, total = compute_tax_and_total(payload.quantity, payload.price, payload.tax_rate)
+    # BSON dates hold milliseconds; truncate so the POST response matches later reads
+    now = datetime.now(timezone.utc)
+    now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+    data = payload.model_dump()
+    data.update({"_id": payload.invoice_no, "tax": tax, "total": total, "created_at": now, "updated_at": now})
+    return data
+
 @app.post("/api/invoices")
 async def create_invoice(payload: InvoiceCreate):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
 
-    tax, total = compute_tax_and_total(payload.quantity, payload.price, payload.tax_rate)
-
-    invoice = Invoice(
-        invoice_no=payload.invoice_no,
-        customer=payload.customer,
-        item_name=payload.item_name,
-        surat_jalan_no=payload.surat_jalan_no,
-        quantity=payload.quantity,
-        price=payload.price,
-        tax_rate=payload.tax_rate,
-        tax=tax,
-        total=total,
-    )
-    data = invoice.model_dump()
-    data["_id"] = payload.invoice_no  # primary key
+    data = build_invoice_doc(payload)
 
     try:
-        db["invoice"].insert_one(data)
+        await db["invoice"].insert_one(data)
     except Exception as e:
         if "E11000" in str(e):
             raise HTTPException(status_code=409, detail="Invoice number already exists")
         raise
+    await invalidate_invoice_cache(payload.invoice_no)
 
-    doc = db["invoice"].find_one({"_id": payload.invoice_no})
-    return serialize_doc(doc)
+    # data is exactly what was inserted (timestamps included), so no read-back
+    return MongoJSONResponse(serialize_doc(data))
+
+# Caps the models and documents a single bulk request holds in memory
+MAX_BULK_INVOICES = 1000
+
+@app.post("/api/invoices/bulk")
+async def create_invoices_bulk(payload: List[InvoiceCreate] = Body(..., max_length=MAX_BULK_INVOICES)):
+    if db is None:
+        raise HTTPException(status_code=500, detail="Database not configured")
+    if not payload:
+        return {"inserted": 0, "results": []}
+
+    ops = [InsertOne(build_invoice_doc(inv)) for inv in payload]
+
+    # Unordered: one bad row (e.g. a duplicate invoice_no) doesn't stop the rest
+    errors = {}
+    write_concern_errors = []
+    try:
+        await db["invoice"].bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        errors = {err["index"]: err for err in e.details.get("writeErrors", [])}
+        # Rows were written but not acknowledged by a majority; they may yet roll back
+        write_concern_errors = [err.get("errmsg") for err in e.details.get("writeConcernErrors", [])]
+
+    results = []
+    for i, inv in enumerate(payload):
+        err = errors.get(i)
+        if err is None:
+            results.append({"invoice_no": inv.invoice_no, "status": "inserted"})
+        elif err.get("code") == 11000:
+            results.append({"invoice_no": inv.invoice_no, "status": "duplicate", "detail": "Invoice number already exists"})
+        else:
+            results.append({"invoice_no": inv.invoice_no, "status": "error", "detail": err.get("errmsg")})
+
+    inserted = [r["invoice_no"] for r in results if r["status"] == "inserted"]
+    if inserted:
+        await invalidate_invoice_cache(*inserted)
+    response = {"inserted": len(inserted), "results": results}
+    if write_concern_errors:
+        response["write_concern_error"] = "; ".join(write_concern_errors)
+    return response
+
+# Only the invoice fields themselves; server-side timestamps stay in Mongo
+INVOICE_LIST_PROJECTION = {field: 1 for field in Invoice.model_fields}
+
+# List row shape: the Invoice fields plus Mongo's _id, emitted as "id"
+InvoiceRow = TypedDict(
+    "InvoiceRow",
+    {
+        # Invoices use str ids, but create_document rows carry ObjectIds
+        "_id": Annotated[Any, PlainSerializer(str), Field(serialization_alias="id")],
+        **{name: field.annotation for name, field in Invoice.model_fields.items()},
+    },
+    total=False,
+)
+INVOICE_LIST_ADAPTER = TypeAdapter(List[InvoiceRow])
 
 @app.get("/api/invoices")
-async def list_invoices():
+@cached(prefix="invoice:list", expire=3600)
+async def list_invoices(skip: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=1000)):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
-    docs = get_documents("invoice")
-    return [serialize_doc(d) for d in docs]
+    cursor = (
+        db["invoice"]
+        .find({}, projection=INVOICE_LIST_PROJECTION)
+        # _id breaks updated_at ties so skip/limit pages are stable
+        .sort([("updated_at", -1), ("_id", 1)])
+        .skip(skip)
+        .limit(limit)
+        .batch_size(100)
+    )
+    docs = await cursor.to_list(length=limit)
+    # pydantic-core renames _id -> id and encodes the whole page in one pass
+    return Response(content=INVOICE_LIST_ADAPTER.dump_json(docs, by_alias=True), media_type="application/json")
 
 @app.get("/api/invoices/{invoice_no}")
+@cached(prefix="invoice:{invoice_no}", expire=3600)
 async def get_invoice(invoice_no: str):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
-    doc = db["invoice"].find_one({"_id": invoice_no})
+    doc = await db["invoice"].find_one({"_id": invoice_no})
     if not doc:
         raise HTTPException(status_code=404, detail="Invoice not found")
-    return serialize_doc(doc)
+    return MongoJSONResponse(serialize_doc(doc))
+
+async def replace_invoice_key(new_doc: dict, current_invoice_no: str):
+    """Insert the renamed invoice and delete the old one, in a transaction when the server supports it"""
+    try:
+        async with await db.client.start_session() as session:
+            async with session.start_transaction():
+                await db["invoice"].insert_one(new_doc, session=session)
+                await db["invoice"].delete_one({"_id": current_invoice_no}, session=session)
+        return
+    except DuplicateKeyError:
+        raise
+    except OperationFailure as e:
+        # Standalone mongod has no transactions (IllegalOperation); fall back to two writes
+        if e.code != 20:
+            raise
+    await db["invoice"].insert_one(new_doc)
+    await db["invoice"].delete_one({"_id": current_invoice_no})
 
 @app.put("/api/invoices/{current_invoice_no}")
 async def update_invoice(current_invoice_no: str, payload: InvoiceUpdate):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
 
-    existing = db["invoice"].find_one({"_id": current_invoice_no})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Invoice not found")
-
     update_data = {k: v for k, v in payload.model_dump(exclude_unset=True).items()}
-
-    # Determine latest values for computation
-    q = update_data.get("quantity", existing.get("quantity"))
-    p = update_data.get("price", existing.get("price"))
-    tr = update_data.get("tax_rate", existing.get("tax_rate", 11.0))
-    tax, total = compute_tax_and_total(q, p, tr)
-    update_data["tax"] = tax
-    update_data["total"] = total
-    update_data["updated_at"] = __import__('datetime').datetime.utcnow()
+    update_data["updated_at"] = datetime.now(timezone.utc)
 
     new_invoice_no = update_data.pop("invoice_no", None)
 
     if new_invoice_no and new_invoice_no != current_invoice_no:
+        # Build the renamed document server-side, with tax/total recomputed
+        # by the same pipeline used for regular updates
+        pipeline = [
+            {"$match": {"_id": current_invoice_no}},
+            *tax_and_total_pipeline(update_data),
+            {"$set": {"_id": {"$literal": new_invoice_no}, "invoice_no": {"$literal": new_invoice_no}}},
+            # Remove previous id remnants if any
+            {"$unset": "id"},
+        ]
+        docs = await db["invoice"].aggregate(pipeline).to_list(length=1)
+        if not docs:
+            raise HTTPException(status_code=404, detail="Invoice not found")
+        new_doc = docs[0]
+
         # Changing primary key: ensure target not exists
-        conflict = db["invoice"].find_one({"_id": new_invoice_no})
+        conflict = await db["invoice"].find_one({"_id": new_invoice_no})
         if conflict:
             raise HTTPException(status_code=409, detail="Target invoice number already exists")
-        # Create new document with new _id
-        new_doc = {**existing, **update_data}
-        new_doc["_id"] = new_invoice_no
-        # Remove previous id remnants if any
-        new_doc.pop("id", None)
         try:
-            db["invoice"].insert_one(new_doc)
-            db["invoice"].delete_one({"_id": current_invoice_no})
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=str(e))
-        created = db["invoice"].find_one({"_id": new_invoice_no})
-        return serialize_doc(created)
+            await replace_invoice_key(new_doc, current_invoice_no)
+        except DuplicateKeyError:
+            raise HTTPException(status_code=409, detail="Target invoice number already exists")
+        await invalidate_invoice_cache(current_invoice_no, new_invoice_no)
+        return MongoJSONResponse(serialize_doc(new_doc))
     else:
-        # Regular update
-        res = db["invoice"].update_one({"_id": current_invoice_no}, {"$set": update_data})
-        if res.matched_count == 0:
+        # Regular update: apply the changes and let Mongo recompute tax/total
+        # from the resulting fields, all in a single round-trip
+        doc = await db["invoice"].find_one_and_update(
+            {"_id": current_invoice_no},
+            tax_and_total_pipeline(update_data),
+            return_document=ReturnDocument.AFTER,
+            upsert=False,
+        )
+        if doc is None:
             raise HTTPException(status_code=404, detail="Invoice not found")
-        doc = db["invoice"].find_one({"_id": current_invoice_no})
-        return serialize_doc(doc)
+        await invalidate_invoice_cache(current_invoice_no)
+        return MongoJSONResponse(serialize_doc(doc))
 
 @app.delete("/api/invoices/{invoice_no}")
 async def delete_invoice(invoice_no: str):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
-    result = db["invoice"].delete_one({"_id": invoice_no})
+    result = await db["invoice"].delete_one({"_id": invoice_no})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Invoice not found")
+    await invalidate_invoice_cache(invoice_no)
     return {"deleted": True, "invoice_no": invoice_no}
@@ -11,7 +11,7 @@ Model name is converted to lowercase for the collection name:
 - BlogPost -> "blogs" collection
 """
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional
 
 # Example schemas (you can keep or remove if not needed by your app)
@@ -45,6 +45,8 @@ class Invoice(BaseModel):
     Invoice collection schema
     Collection name: "invoice"
     """
+    model_config = ConfigDict(extra="ignore", frozen=True, str_strip_whitespace=True)
+
     invoice_no: str = Field(..., description="Nomor Invoice (primary key)")
     customer: str = Field(..., description="Nama Customer")
     item_name: str = Field(..., description="Nama Barang")